@@ -4,478 +4,1477 @@ Simple YouTube Short to Music Identification Pipeline
 Uses ACRCloud API for reliable song identification
 """
 
+import atexit
+import argparse
 import webbrowser
 import subprocess
 import sys
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from requests_toolbelt.multipart.encoder import MultipartEncoder
 import json
+import logging
 import os
 import base64
-import hashlib
 import hmac
+import hashlib
+import re
+import fnmatch
+import shutil
 import time
 import random
+import importlib.util
+import mimetypes
+import secrets
+import concurrent.futures
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+import threading
+from functools import lru_cache
 from pathlib import Path
+import numpy as np
 from dotenv import load_dotenv
 
+# orjson parses the ACRCloud responses faster; fall back to the stdlib parser.
+# orjson.JSONDecodeError subclasses json.JSONDecodeError, so one except covers both
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+# mutagen reads durations from file headers without spawning ffprobe
+try:
+    import mutagen
+except ImportError:
+    mutagen = None
+
 # Load environment variables from .env file
 load_dotenv()
 
+# Progress goes through logging so batch runs can mute it; the identified song
+# is still printed. LOG_LEVEL defaults to INFO on a terminal, WARNING otherwise
+logger = logging.getLogger(__name__)
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO' if sys.stdout.isatty() else 'WARNING').upper()
+
+# Shared keep-alive session so parallel segment uploads to the same ACRCloud
+# host reuse TCP/TLS connections instead of handshaking per request.
+# The pool holds one connection per concurrent segment upload (up to 5), and
+# failed connection attempts are retried with a short backoff
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=2, pool_maxsize=5,
+                                       max_retries=Retry(total=3, backoff_factor=0.3)))
+atexit.register(_SESSION.close)
+
+# Demucs model used for vocal removal. htdemucs is a single, unquantized
+# model; the quantized ones (mdx_extra_q, ...) need the separate diffq package
+DEMUCS_MODEL = os.getenv('DEMUCS_MODEL', 'htdemucs')
+
+# When Demucs writes no_vocals.mp3, 128 kbps is plenty for fingerprinting
+# and much cheaper to encode and upload than the 320 kbps default
+DEMUCS_MP3_BITRATE = 128
+
+# Number of Demucs chunks run through the model in one forward pass; halved
+# automatically when the GPU runs out of memory
+DEMUCS_BATCH_SIZE = int(os.getenv('DEMUCS_BATCH_SIZE', '4'))
+
+# Intra-op threads for CPU Demucs; unset keeps torch's default of one per
+# physical core (logical cores oversubscribe the FPUs shared by hyperthreads)
+DEMUCS_THREADS = int(os.getenv('DEMUCS_THREADS', '0'))
+
+# Set DEMUCS_INT8=1 to run the LSTM and linear layers of CPU Demucs in int8
+# (dynamic quantization); convolutions stay fp32
+DEMUCS_INT8 = os.getenv('DEMUCS_INT8', '0') == '1'
+
+# Start vocal removal in the background while the original audio is being
+# identified; set SEPARATE_IN_BACKGROUND=0 to only separate after a miss
+SEPARATE_IN_BACKGROUND = os.getenv('SEPARATE_IN_BACKGROUND', '1') != '0'
+
+# Successful identifications are cached by audio hash and by video ID
+CACHE_DIR = Path.home() / ".cache" / "ytshort_acr"
+CACHE_TTL = 30 * 24 * 60 * 60  # 30 days
+_CACHE = None
+
+# --no-cache (or NO_CACHE=1) bypasses the cache for both lookups and stores
+USE_CACHE = os.getenv('NO_CACHE', '0') != '1'
+
+# Sample rate of the mono 32 kbps MP3 segments uploaded to ACRCloud; a
+# fraction of the bytes of a stereo 44.1 kHz clip. 0 uploads stream-copied segments
+UPLOAD_SAMPLE_RATE = int(os.getenv('UPLOAD_SAMPLE_RATE', '8000'))
+
+# ffmpeg output options for those segments; compression_level 9 is lame's
+# fastest algorithm (-q 9), and its quality gain is inaudible at 32 kbps
+UPLOAD_CODEC_ARGS = ["-ac", "1", "-ar", str(UPLOAD_SAMPLE_RATE), "-c:a", "libmp3lame",
+                     "-b:a", "32k", "-compression_level", "9"]
+
+# Uploaded segments are re-encoded anyway, so the separators write lossless
+# WAV and the only MP3 encode is the small upload one; with stream-copied
+# segments they keep writing MP3 so the uploads stay small
+SEPARATED_FORMAT = "wav" if UPLOAD_SAMPLE_RATE > 0 else "mp3"
+
+# Length of the first upload, cut from the middle of the first segment; when
+# ACRCloud matches it with at least PROBE_MIN_CONFIDENCE the remaining
+# segments are not uploaded. PROBE_SECONDS=0 uploads every segment right away
+PROBE_SECONDS = int(os.getenv('PROBE_SECONDS', '10'))
+PROBE_MIN_CONFIDENCE = 80
+
+# Unix socket of an optional long-lived Demucs worker
+# (python simple_pipeline.py --demucs-server) that keeps torch and the model
+# loaded between runs; separation runs in-process when nothing listens on it
+DEMUCS_SOCKET = os.getenv('DEMUCS_SOCKET', str(CACHE_DIR / "demucs.sock"))
+
+# Shared secret the worker and the pipeline authenticate with before any
+# request is unpickled; created by the worker, readable only by its owner
+DEMUCS_AUTHKEY_PATH = CACHE_DIR / "demucs.key"
+
+# Number of batch URLs downloaded in the background ahead of the one being
+# identified; the downloads mostly wait on the network, so they overlap well
+DOWNLOAD_AHEAD = max(1, int(os.getenv('DOWNLOAD_AHEAD', '3')))
+
+# Vocal separator: "auto" tries the UVR model and falls back to Demucs, "vr"
+# or "demucs" use only that one, and "none" only tries the original audio
+SEPARATOR = os.getenv('SEPARATOR', 'auto').lower()
+
+# UVR VR model used by audio-separator; far cheaper than Demucs and
+# fingerprinting tolerates its imperfect separation
+VR_MODEL = os.getenv('VR_MODEL', '2_HP-UVR.pth')
+
 def check_yt_dlp():
-    """Check if yt-dlp is installed"""
-    try:
-        subprocess.run(["yt-dlp", "--version"], capture_output=True, check=True)
-        return True
-    except (subprocess.CalledProcessError, FileNotFoundError):
-        return False
+    """Check if the yt-dlp Python package is installed"""
+    importlib.invalidate_caches()  # Pick up a package installed while running
+    return importlib.util.find_spec("yt_dlp") is not None
 
-def download_with_yt_dlp(url):
-    """Download YouTube Short audio directly as MP3 using yt-dlp"""
-    print(f"🎬 Downloading audio from: {url}")
+def download_with_yt_dlp(url, outtmpl='audio.%(ext)s', quiet=False):
+    """Download YouTube Short audio stream as-is using the yt-dlp Python API
+    
+    The best audio stream (usually m4a or opus) is kept in its original
+    container; ffprobe/ffmpeg and Demucs all accept it, so the lossy MP3
+    transcode is skipped. quiet hides the progress bar for background
+    downloads.
+    """
+    from yt_dlp import YoutubeDL
+    from yt_dlp.utils import DownloadError
     
+    logger.info("🎬 Downloading audio from: %s", url)
+    
+    ydl_opts = {
+        'format': 'bestaudio/best',  # Audio stream only
+        'outtmpl': outtmpl,  # Output filename
+        'postprocessors': [],  # No ffmpeg re-encode
+        'quiet': quiet,
+        'noprogress': quiet,
+        'concurrent_fragment_downloads': 4,  # Fetch HLS/DASH fragments in parallel
+    }
     try:
-        cmd = [
-            "yt-dlp",
-            "-x",  # Extract audio only
-            "--audio-format", "mp3",  # Convert to MP3
-            "--audio-quality", "0",  # Best quality
-            "-o", "audio.%(ext)s",  # Output filename
-            url
-        ]
-        
-        subprocess.run(cmd, check=True)
-        print("✅ Audio download completed!")
-        
-        # Find the downloaded audio file
-        audio_files = list(Path(".").glob("audio.*"))
-        if audio_files:
-            return audio_files[0]
-        else:
-            print("❌ Could not find downloaded audio file")
-            return None
-            
-    except subprocess.CalledProcessError as e:
-        print(f"❌ Download failed: {e}")
+        with YoutubeDL(ydl_opts) as ydl:
+            info = ydl.extract_info(url, download=True)
+            audio_path = Path(ydl.prepare_filename(info))
+    except DownloadError as e:
+        logger.error("❌ Download failed: %s", e)
+        return None
+    
+    if audio_path.exists():
+        logger.info("✅ Audio download completed!")
+        return audio_path
+    else:
+        logger.error("❌ Could not find downloaded audio file")
         return None
 
-def get_audio_duration(audio_path):
-    """Get audio duration using ffprobe"""
+@lru_cache(maxsize=128)
+def _probe_duration(path_str, mtime):
+    """Read a path's duration; mtime is only part of the cache key
+    
+    mutagen reads it from the container headers in-process (MP3, M4A, WAV,
+    Ogg/Opus); other formats such as WebM fall back to an ffprobe run.
+    """
+    if mutagen is not None:
+        try:
+            info = mutagen.File(path_str)
+            if info is not None and info.info.length:
+                return float(info.info.length)
+        except Exception:
+            pass
     try:
         cmd = [
             "ffprobe", 
             "-v", "quiet", 
             "-show_entries", "format=duration", 
             "-of", "csv=p=0", 
-            str(audio_path)
+            path_str
         ]
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, check=True)
         return float(result.stdout.strip())
     except (subprocess.CalledProcessError, FileNotFoundError, ValueError):
-        print("⚠️  Could not determine audio duration, assuming 60 seconds")
+        logger.warning("⚠️  Could not determine audio duration, assuming 60 seconds")
         return 60.0
 
-def extract_audio_segment(input_path, output_path, start_time, duration=20):
-    """Extract a segment from audio file using ffmpeg"""
+def get_audio_duration(audio_path):
+    """Get audio duration using ffprobe, cached per (path, mtime)"""
+    try:
+        mtime = os.stat(audio_path).st_mtime
+    except OSError:
+        mtime = None
+    return _probe_duration(str(audio_path), mtime)
+
+def extract_audio_segment(input_path, output_path, start_time, duration=20, downsample=False):
+    """Extract a segment from audio file using ffmpeg
+    
+    With downsample, the segment is re-encoded as a small mono MP3 at
+    UPLOAD_SAMPLE_RATE instead of being stream-copied.
+    """
+    if downsample:
+        codec_args = UPLOAD_CODEC_ARGS
+    else:
+        codec_args = ["-c", "copy"]  # Copy without re-encoding for speed
     try:
         cmd = [
             "ffmpeg",
+            "-ss", str(start_time),  # Input-side seek jumps straight to the start
             "-i", str(input_path),
-            "-ss", str(start_time),
             "-t", str(duration),
-            "-c", "copy",  # Copy without re-encoding for speed
+            *codec_args,
+            "-avoid_negative_ts", "make_zero",
             "-y",  # Overwrite output file
             str(output_path)
         ]
-        subprocess.run(cmd, check=True, capture_output=True)
+        subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
         return True
     except subprocess.CalledProcessError as e:
-        print(f"❌ Failed to extract segment: {e}")
+        logger.error("❌ Failed to extract segment: %s", e)
         return False
 
-def remove_speech_demucs(audio_path):
-    """Remove vocals using local Demucs (Python API, fallback to subprocess)"""
-    print("🔇 Removing vocals using local Demucs...")
+def extract_audio_segments(input_path, segments):
+    """Extract several segments in a single ffmpeg pass.
+    
+    segments is a list of (output_path, start_time, duration) tuples; one
+    process demuxes the input once and writes every output.
+    """
+    # Fast input-side seek to the earliest segment; the other outputs seek
+    # relative to it, since timestamps restart at zero after an input seek
+    earliest = min(start_time for _, start_time, _ in segments)
+    cmd = ["ffmpeg", "-y", "-ss", str(earliest), "-i", str(input_path)]
+    for output_path, start_time, duration in segments:
+        cmd += [
+            "-ss", str(start_time - earliest),
+            "-t", str(duration),
+            "-c", "copy",  # Copy without re-encoding for speed
+            str(output_path)
+        ]
     try:
-        import demucs.separate
-        # Use the recommended model for best quality, output as MP3
-        args = [
-            "--two-stems", "vocals",
-            "-n", "htdemucs",
-            "--mp3",  # Output as MP3 instead of WAV
-            str(audio_path)
+        subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return True
+    except subprocess.CalledProcessError as e:
+        logger.error("❌ Failed to extract segments: %s", e)
+        return False
+
+def plan_segment_start_times(duration, segment_length=20, max_segments=5):
+    """Spread up to max_segments start times evenly across the audio"""
+    segment_count = min(max_segments, int(duration // segment_length))
+    available_duration = duration - segment_length  # Leave room for the last segment
+    if segment_count < 1 or available_duration <= 0:
+        return []
+    
+    # Spread segments across the audio, avoiding the very beginning and end
+    return (5.0 + np.arange(segment_count) * (available_duration - 10.0) / segment_count).tolist()
+
+def decode_audio_mono(audio_path, sample_rate=8000):
+    """Decode audio to a mono float32 numpy array with ffmpeg (low rate is enough for energy)"""
+    cmd = [
+        "ffmpeg",
+        "-v", "quiet",
+        "-i", str(audio_path),
+        "-ac", "1",
+        "-ar", str(sample_rate),
+        "-f", "f32le",
+        "-"
+    ]
+    try:
+        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True)
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return None
+    return np.frombuffer(result.stdout, dtype=np.float32)
+
+def frame_rms(y, win):
+    """RMS of consecutive non-overlapping frames of win samples"""
+    n_frames = len(y) // win
+    frames = y[:n_frames * win].reshape(n_frames, win).astype(np.float64)
+    return np.sqrt((frames * frames).mean(axis=1))
+
+def plan_loudest_start_times(audio_path, duration, segment_length=20, max_segments=5):
+    """Pick the start times of the most energetic non-overlapping segments
+    
+    Falls back to plan_segment_start_times when the audio cannot be decoded.
+    """
+    sample_rate = 8000
+    y = decode_audio_mono(audio_path, sample_rate)
+    if y is None or len(y) < segment_length * sample_rate:
+        return plan_segment_start_times(duration, segment_length, max_segments)
+    
+    # 1-second RMS frames, then the mean energy of every segment-long window
+    rms = frame_rms(y, sample_rate)
+    window_energy = np.convolve(rms, np.ones(segment_length), mode="valid") / segment_length
+    
+    segment_count = min(max_segments, len(rms) // segment_length)
+    start_times = []
+    for _ in range(segment_count):
+        best = int(np.argmax(window_energy))
+        if window_energy[best] < 0:
+            break
+        start_times.append(float(best))
+        # Exclude every window overlapping the one just picked
+        window_energy[max(0, best - segment_length + 1):best + segment_length] = -1
+    
+    return sorted(start_times)
+
+def merge_segment_windows(start_times, segment_length=20):
+    """Merge overlapping [start, start + segment_length] windows into their union"""
+    windows = []
+    for start in sorted(start_times):
+        end = start + segment_length
+        if windows and start <= windows[-1][1]:
+            windows[-1][1] = max(windows[-1][1], end)
+        else:
+            windows.append([start, end])
+    return windows
+
+def trim_audio_to_segments(audio_path, start_times, segment_length=20):
+    """Cut the audio down to the union of the planned segment windows.
+    
+    Returns (trimmed_path, trimmed_start_times) where the start times are
+    remapped onto the trimmed timeline, or (None, None) if trimming is not
+    worthwhile or fails.
+    """
+    duration = get_audio_duration(audio_path)
+    windows = merge_segment_windows(start_times, segment_length)
+    if not windows or sum(end - start for start, end in windows) >= duration - 1:
+        return None, None
+    
+    # Name the temp files after the input (audio, audio_2, ... in batch and
+    # --serve runs) so one URL's separation never shares them with another's
+    audio_path = Path(audio_path)
+    trimmed_path = Path(f"{audio_path.stem}_trimmed{audio_path.suffix}")
+    part_paths = [Path(f"{audio_path.stem}_trim_part_{i+1}{audio_path.suffix}") for i in range(len(windows))]
+    list_path = Path(f"{audio_path.stem}_trim_list.txt")
+    try:
+        parts = [(part_path, start, end - start) for part_path, (start, end) in zip(part_paths, windows)]
+        if not extract_audio_segments(audio_path, parts):
+            return None, None
+        
+        # Join the parts with the concat demuxer, still without re-encoding
+        list_path.write_text("".join(f"file '{p.resolve().as_posix()}'\n" for p in part_paths))
+        cmd = [
+            "ffmpeg",
+            "-f", "concat",
+            "-safe", "0",
+            "-i", str(list_path),
+            "-c", "copy",
+            "-y",
+            str(trimmed_path)
         ]
-        print(f"⚡ Running: demucs {' '.join(args)}")
-        demucs.separate.main(args)
-        # Find the output file (Demucs creates it in separated/htdemucs/audio_name/)
-        audio_name = Path(audio_path).stem
-        no_vocals_path = Path("separated") / "htdemucs" / audio_name / "no_vocals.mp3"
+        subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    except (subprocess.CalledProcessError, FileNotFoundError) as e:
+        logger.error("❌ Failed to trim audio: %s", e)
+        return None, None
+    finally:
+        for path in part_paths + [list_path]:
+            try:
+                path.unlink()
+            except OSError:
+                pass
+    
+    # Map each original start time onto the trimmed timeline
+    trimmed_start_times = []
+    for start in start_times:
+        offset = 0
+        for window_start, window_end in windows:
+            if window_start <= start < window_end:
+                trimmed_start_times.append(offset + start - window_start)
+                break
+            offset += window_end - window_start
+    
+    return trimmed_path, trimmed_start_times
+
+# demucs.separate pulls in torch/torchaudio (several seconds), so it is only
+# imported on first use and then cached here
+_DEMUCS = None
+
+def _demucs_module():
+    """Import demucs.separate once and return the cached module"""
+    global _DEMUCS
+    if _DEMUCS is None:
+        import demucs.separate
+        _DEMUCS = demucs.separate
+    return _DEMUCS
+
+def _preload_demucs(load_weights=True):
+    """Warm the Demucs import, and with load_weights the model, in the background; errors surface on real use"""
+    try:
+        _demucs_module()
+        if not load_weights:
+            return
+        device = get_demucs_device()
+        _get_demucs_model(DEMUCS_MODEL, device or "cpu")
+    except Exception:
+        pass
+
+def get_demucs_device():
+    """Return "cuda" or "mps" when a GPU is available to torch, otherwise None (Demucs default)"""
+    try:
+        import torch
+        if torch.cuda.is_available():
+            return "cuda"
+        if torch.backends.mps.is_available():
+            return "mps"  # Apple Silicon; stays fp32, fp16 is only used on CUDA
+    except ImportError:
+        pass
+    return None
+
+def _configure_cpu_threads():
+    """Run CPU inference on one inter-op thread so it does not stack on the intra-op pool"""
+    import torch
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass  # Only allowed before torch starts its first parallel work
+    if DEMUCS_THREADS > 0:
+        torch.set_num_threads(DEMUCS_THREADS)
+
+@lru_cache(maxsize=None)
+def demucs_uses_fp16(device):
+    """fp16 only pays off on CUDA GPUs with tensor cores (compute capability 7.0+)"""
+    if device != "cuda":
+        return False
+    import torch
+    return torch.cuda.get_device_capability()[0] >= 7
+
+# Loaded Demucs models keyed by (model_name, device), so retries and later
+# separations skip the checkpoint load and model construction. The lock stops
+# the preload thread and a separation from loading the same model twice.
+_DEMUCS_MODELS = {}
+_DEMUCS_MODELS_LOCK = threading.Lock()
+
+def _get_demucs_model(model_name, device):
+    """Load a pretrained Demucs model once per device (fp16 on recent CUDA GPUs, optionally int8 on CPU) and cache it"""
+    key = (model_name, device)
+    with _DEMUCS_MODELS_LOCK:
+        if key not in _DEMUCS_MODELS:
+            from demucs.pretrained import get_model
+            
+            if device == "cpu":
+                _configure_cpu_threads()
+            model = get_model(model_name)
+            model.to(device)
+            if demucs_uses_fp16(device):
+                model.half()
+            model.eval()
+            if device == "cpu" and DEMUCS_INT8:
+                import torch
+                model = torch.quantization.quantize_dynamic(model, {torch.nn.LSTM, torch.nn.Linear}, dtype=torch.qint8)
+            if device == "cuda":
+                _warm_up_cuda(model)
+            _DEMUCS_MODELS[key] = model
+        return _DEMUCS_MODELS[key]
+
+def _warm_up_cuda(model):
+    """Autotune cuDNN on one silent batch, so the first real separation starts at full speed
+    
+    Every batch has the same (chunks, channels, samples) shape, so the plans
+    cuDNN benchmarks here are reused for the rest of the process.
+    """
+    import torch
+    torch.backends.cudnn.benchmark = True
+    dtype = torch.float16 if demucs_uses_fp16("cuda") else torch.float32
+    silence = torch.zeros(model.audio_channels, int(7 * model.samplerate) * DEMUCS_BATCH_SIZE,
+                          device="cuda", dtype=dtype)
+    with torch.inference_mode():
+        apply_demucs_batched(model, silence, "cuda", segment=7)
+
+def apply_demucs_batched(model, mix, device, segment=7, batch_size=DEMUCS_BATCH_SIZE):
+    """Separate mix (channels, samples) in segment-second chunks, several per forward pass
+    
+    Without overlap the chunks need no overlap-add, so they are zero-padded to
+    a whole number of segments, stacked along the batch axis and concatenated
+    back; apply_model(split=True) would run them one at a time.
+    Returns a float32 CPU tensor of shape (sources, channels, samples).
+    """
+    import torch
+    from demucs.apply import apply_model
+    
+    channels, length = mix.shape
+    chunk = int(segment * model.samplerate)
+    num_chunks = -(-length // chunk)
+    padded = torch.nn.functional.pad(mix, (0, num_chunks * chunk - length))
+    chunks = padded.reshape(channels, num_chunks, chunk).transpose(0, 1)
+    
+    outputs = []
+    start = 0
+    while start < num_chunks:
+        try:
+            out = apply_model(model, chunks[start:start + batch_size].contiguous(),
+                              shifts=0, split=False, device=device)
+        except RuntimeError as e:
+            if "out of memory" not in str(e) or batch_size == 1:
+                raise
+            batch_size //= 2
+            logger.warning("⚠️  Out of memory, retrying with %s chunks per batch...", batch_size)
+            torch.cuda.empty_cache()
+            continue
+        outputs.append(out.float().cpu())
+        start += batch_size
+    
+    # (chunks, sources, channels, chunk) -> (sources, channels, samples)
+    out = torch.cat(outputs)
+    return out.permute(1, 2, 0, 3).reshape(out.shape[1], channels, -1)[..., :length]
+
+def separate_with_demucs_model(audio_path, model_name, no_vocals_path, device):
+    """Separate with the cached Demucs model through demucs.apply, writing no_vocals_path"""
+    import torch
+    from demucs.audio import AudioFile, save_audio
+    
+    model = _get_demucs_model(model_name, device)
+    dtype = torch.float16 if demucs_uses_fp16(device) else torch.float32
+    
+    wav = AudioFile(Path(audio_path)).read(streams=0, samplerate=model.samplerate, channels=model.audio_channels)
+    ref = wav.mean(0)
+    wav = (wav - ref.mean()) / ref.std()
+    
+    # No shifts and no overlap skip the test-time augmentation passes (the seams
+    # do not matter for fingerprinting), and short segments keep VRAM usage low
+    # enough to avoid OOMs on small GPUs even when batched
+    with torch.inference_mode():
+        sources = apply_demucs_batched(model, wav.to(device, dtype), device, segment=7)
+    sources = sources * ref.std() + ref.mean()
+    
+    # Everything except the vocals stem is the background music
+    no_vocals = sum(source for name, source in zip(model.sources, sources) if name != "vocals")
+    no_vocals_path.parent.mkdir(parents=True, exist_ok=True)
+    save_audio(no_vocals, no_vocals_path, samplerate=model.samplerate, bitrate=DEMUCS_MP3_BITRATE)
+
+def _demucs_authkey(create=False):
+    """Read the Demucs worker's authkey, generating it with create; None if missing"""
+    try:
+        return DEMUCS_AUTHKEY_PATH.read_bytes()
+    except FileNotFoundError:
+        if not create:
+            return None
+    DEMUCS_AUTHKEY_PATH.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+    authkey = secrets.token_bytes(32)
+    fd = os.open(DEMUCS_AUTHKEY_PATH, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, 'wb') as fh:
+        fh.write(authkey)
+    return authkey
+
+def _is_separated_output(path):
+    """True for a no_vocals file somewhere below a separated/ directory"""
+    path = Path(path).resolve()
+    return path.name in ("no_vocals.wav", "no_vocals.mp3") and "separated" in path.parent.parts
+
+def separate_with_demucs_server(audio_path, model_name, no_vocals_path):
+    """Ask the Demucs worker to separate audio_path; False if no worker is running"""
+    if not Path(DEMUCS_SOCKET).exists():
+        return False
+    authkey = _demucs_authkey()
+    if authkey is None:
+        return False
+    try:
+        with Client(DEMUCS_SOCKET, family='AF_UNIX', authkey=authkey) as conn:
+            conn.send({
+                'audio_path': str(Path(audio_path).resolve()),
+                'model_name': model_name,
+                'no_vocals_path': str(no_vocals_path.resolve()),
+            })
+            reply = conn.recv()
+    except (OSError, EOFError, AuthenticationError) as e:
+        logger.warning("⚠️  Demucs worker unavailable: %s", e)
+        return False
+    if reply.get('error'):
+        logger.warning("⚠️  Demucs worker failed: %s", reply['error'])
+        return False
+    return True
+
+def serve_demucs():
+    """Run the Demucs worker: load torch and the model once, then serve separations"""
+    device = get_demucs_device() or "cpu"
+    model_name = DEMUCS_MODEL
+    logger.info("⏳ Loading %s on %s...", model_name, device)
+    _get_demucs_model(model_name, device)
+    
+    socket_path = Path(DEMUCS_SOCKET)
+    socket_path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+    socket_path.unlink(missing_ok=True)  # Stale socket from a killed worker
+    authkey = _demucs_authkey(create=True)
+    # Bind under an owner-only umask, so the socket is never reachable by
+    # other users, not even before a chmod
+    old_umask = os.umask(0o077)
+    try:
+        listener = Listener(str(socket_path), family='AF_UNIX', authkey=authkey)
+    finally:
+        os.umask(old_umask)
+    with listener:
+        logger.info("✅ Demucs worker listening on %s", socket_path)
+        try:
+            while True:
+                try:
+                    conn = listener.accept()
+                except (AuthenticationError, OSError, EOFError) as e:
+                    logger.warning("⚠️  Rejected Demucs worker connection: %s", e)
+                    continue
+                with conn:
+                    try:
+                        request = conn.recv()
+                    except EOFError:
+                        continue  # Client went away before sending a request
+                    try:
+                        if not _is_separated_output(request['no_vocals_path']):
+                            raise ValueError(f"output path outside separated/: {request['no_vocals_path']}")
+                        separate_with_demucs_model(request['audio_path'], request['model_name'],
+                                                   Path(request['no_vocals_path']), device)
+                        conn.send({'error': None})
+                        logger.info("✅ Separated %s", request['audio_path'])
+                    except Exception as e:
+                        conn.send({'error': str(e)})
+                        logger.error("❌ Separation failed: %s", e)
+        except KeyboardInterrupt:
+            logger.info("\n👋 Demucs worker stopped")
+
+def remove_speech_demucs(audio_path):
+    """Remove vocals using local Demucs (cached model, CLI API, fallback to subprocess)"""
+    logger.info("🔇 Removing vocals using local Demucs...")
+    device = get_demucs_device()
+    model_name = DEMUCS_MODEL
+    args = [
+        "--two-stems", "vocals",
+        "-n", model_name,
+    ]
+    if SEPARATED_FORMAT == "mp3":
+        args += ["--mp3", "--mp3-bitrate", str(DEMUCS_MP3_BITRATE)]  # Output as MP3 instead of WAV
+    if device:
+        args += ["-d", device]
+    args.append(str(audio_path))
+    # Find the output file (Demucs creates it in separated/<model>/audio_name/)
+    audio_name = Path(audio_path).stem
+    no_vocals_path = Path("separated") / model_name / audio_name / f"no_vocals.{SEPARATED_FORMAT}"
+    if separate_with_demucs_server(audio_path, model_name, no_vocals_path) and no_vocals_path.exists():
+        logger.info("✅ Vocals removed by Demucs worker: %s", no_vocals_path)
+        return no_vocals_path
+    try:
+        if device == "cuda":
+            precision = "fp16" if demucs_uses_fp16(device) else "fp32"
+            logger.info("⚡ Running %s on CUDA in %s...", model_name, precision)
+        elif device == "mps":
+            logger.info("⚡ Running %s on Apple GPU (MPS)...", model_name)
+        else:
+            logger.info("⚡ Running %s on CPU...", model_name)
+        separate_with_demucs_model(audio_path, model_name, no_vocals_path, device or "cpu")
         if no_vocals_path.exists():
-            print(f"✅ Vocals removed: {no_vocals_path}")
+            logger.info("✅ Vocals removed: %s", no_vocals_path)
+            return no_vocals_path
+    except Exception as e:
+        logger.warning("⚠️  Demucs model API failed: %s", e)
+        logger.info("🔄 Falling back to demucs.separate...")
+    try:
+        demucs_separate = _demucs_module()
+        logger.info("⚡ Running: demucs %s", ' '.join(args))
+        demucs_separate.main(args)
+        if no_vocals_path.exists():
+            logger.info("✅ Vocals removed: %s", no_vocals_path)
             return no_vocals_path
         else:
-            print(f"❌ Could not find {no_vocals_path}, trying subprocess fallback...")
+            logger.warning("⚠️  Could not find %s, trying subprocess fallback...", no_vocals_path)
     except Exception as e:
-        print(f"⚠️  Demucs Python API failed: {e}")
-        print("🔄 Trying subprocess fallback...")
+        logger.warning("⚠️  Demucs Python API failed: %s", e)
+        logger.info("🔄 Trying subprocess fallback...")
     # Subprocess fallback
     try:
-        import subprocess
-        cmd = [
-            "demucs",
-            "--two-stems", "vocals",
-            "-n", "htdemucs",
-            "--mp3",  # Output as MP3 instead of WAV
-            str(audio_path)
-        ]
-        print(f"⚡ Running: {' '.join(cmd)}")
+        cmd = ["demucs"] + args
+        logger.info("⚡ Running: %s", ' '.join(cmd))
         subprocess.run(cmd, check=True)
-        audio_name = Path(audio_path).stem
-        no_vocals_path = Path("separated") / "htdemucs" / audio_name / "no_vocals.mp3"
         if no_vocals_path.exists():
-            print(f"✅ Vocals removed: {no_vocals_path}")
+            logger.info("✅ Vocals removed: %s", no_vocals_path)
             return no_vocals_path
         else:
-            print(f"❌ Could not find {no_vocals_path}")
+            logger.error("❌ Could not find %s", no_vocals_path)
             return None
     except Exception as e:
-        print(f"❌ Demucs subprocess also failed: {e}")
+        logger.error("❌ Demucs subprocess also failed: %s", e)
+        return None
+
+# Loaded audio-separator instances keyed by model file, so batch and --serve
+# runs load the UVR weights once. The lock also serializes separations, since
+# each one points the shared instance at its own output directory
+_VR_SEPARATORS = {}
+_VR_SEPARATORS_LOCK = threading.Lock()
+
+def _get_vr_separator(model_filename):
+    """Load an audio-separator model once and cache it; call with _VR_SEPARATORS_LOCK held"""
+    if model_filename not in _VR_SEPARATORS:
+        from audio_separator.separator import Separator
+        
+        separator = Separator(output_dir=str(Path("separated") / "vr"), output_format=SEPARATED_FORMAT.upper())
+        separator.load_model(model_filename=model_filename)
+        _VR_SEPARATORS[model_filename] = separator
+    return _VR_SEPARATORS[model_filename]
+
+def remove_speech_vr(audio_path):
+    """Remove vocals using a lightweight UVR VR model via audio-separator (cached model)"""
+    logger.info("🔇 Removing vocals using UVR model %s...", VR_MODEL)
+    output_dir = Path("separated") / "vr" / Path(audio_path).stem
+    try:
+        with _VR_SEPARATORS_LOCK:
+            separator = _get_vr_separator(VR_MODEL)
+            # The loaded model keeps its own copy of the output directory;
+            # audio-separator creates it when writing the stems
+            separator.output_dir = separator.model_instance.output_dir = str(output_dir)
+            output_files = separator.separate(str(audio_path))
+    except Exception as e:
+        logger.warning("⚠️  UVR separation failed: %s", e)
+        return None
+    
+    # audio-separator names the music stem "... (Instrumental) ..."
+    for output_file in output_files:
+        output_path = Path(output_file)
+        if not output_path.is_absolute():
+            output_path = output_dir / output_path
+        if "instrumental" in output_path.name.lower() and output_path.exists():
+            logger.info("✅ Vocals removed: %s", output_path)
+            return output_path
+    
+    logger.error("❌ Could not find instrumental stem in %s", output_files)
+    return None
+
+def remove_speech(audio_path, cancel=None):
+    """Remove vocals with the fast UVR VR model, falling back to Demucs (see SEPARATOR)
+    
+    cancel is an optional threading.Event; once it is set, the Demucs fallback
+    is not started.
+    """
+    if SEPARATOR == "demucs":
+        return remove_speech_demucs(audio_path)
+    no_vocals_path = remove_speech_vr(audio_path)
+    if no_vocals_path or SEPARATOR == "vr":
+        return no_vocals_path
+    if cancel is not None and cancel.is_set():
+        return None
+    logger.info("🔄 Falling back to Demucs...")
+    return remove_speech_demucs(audio_path)
+
+def _result_cache():
+    """Open the on-disk identification cache, or None if diskcache is missing or caching is off"""
+    global _CACHE
+    if not USE_CACHE:
+        return None
+    if _CACHE is None:
+        try:
+            import diskcache
+        except ImportError:
+            return None
+        _CACHE = diskcache.Cache(str(CACHE_DIR))
+    return _CACHE
+
+def hash_audio_file(audio_path):
+    """BLAKE2b digest of the audio bytes, used as the identification cache key"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(str(audio_path), 'rb') as fh:
+        for chunk in iter(lambda: fh.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def extract_video_id(url):
+    """Extract the YouTube video ID from a shorts/watch/youtu.be URL"""
+    match = re.search(r"(?:shorts/|watch\?v=|youtu\.be/|embed/)([A-Za-z0-9_-]{11})", url)
+    return match.group(1) if match else None
+
+def chromaprint_raw(audio_path, length=120):
+    """Raw Chromaprint fingerprint (uint32 per frame) via fpcalc, or None without fpcalc"""
+    if not shutil.which("fpcalc"):
+        return None
+    cmd = ["fpcalc", "-raw", "-length", str(length), str(audio_path)]
+    try:
+        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, check=True)
+    except subprocess.CalledProcessError:
+        return None
+    for line in result.stdout.splitlines():
+        if line.startswith("FINGERPRINT="):
+            values = line[len("FINGERPRINT="):].split(",")
+            return np.array(values, dtype=np.int64).astype(np.uint32)
+    return None
+
+def _pack_bits(values, width):
+    """Pack each value into width bits of a little-endian bit stream"""
+    bits = (values[:, None] >> np.arange(width)) & 1
+    return np.packbits(bits.astype(np.uint8).ravel(), bitorder="little").tobytes()
+
+def encode_chromaprint(raw, algorithm=1):
+    """Compress a raw fingerprint into the base64 form AcoustID lookups take
+    
+    Mirrors chromaprint_encode_fingerprint, so the raw fingerprint from one
+    fpcalc run serves both the local matches and AcoustID. Each frame is
+    XORed with the previous one, and the gaps between its set bits are
+    stored as 3-bit values (0 ends a frame) with 5-bit overflow for gaps of
+    7 or more. algorithm 1 is fpcalc's default.
+    """
+    raw = np.asarray(raw, dtype=np.uint32)
+    x = raw ^ np.concatenate([np.zeros(1, np.uint32), raw[:-1]])
+    
+    # 1-based positions of the set bits, row by row, as gaps to the previous one
+    rows, cols = np.nonzero((x[:, None] >> np.arange(32, dtype=np.uint32)) & 1)
+    pos = cols.astype(np.int64) + 1
+    first = np.ones(len(pos), bool)
+    first[1:] = rows[1:] != rows[:-1]
+    gaps = np.where(first, pos, pos - np.concatenate([[0], pos[:-1]]))
+    
+    # A 0 closes every frame, including frames without set bits
+    ends = np.cumsum(np.bincount(rows, minlength=len(x)))
+    normal = np.insert(gaps, ends, 0)
+    exceptional = normal[normal >= 7] - 7
+    normal = np.minimum(normal, 7)
+    
+    header = bytes([algorithm & 255]) + len(raw).to_bytes(3, "big")
+    packed = header + _pack_bits(normal, 3) + _pack_bits(exceptional, 5)
+    return base64.urlsafe_b64encode(packed).rstrip(b"=").decode("ascii")
+
+# Set bits per byte value, for popcounts of XORed fingerprints on numpy < 2.0
+_POPCOUNT8 = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+def _popcount32(x):
+    """Set bits of each uint32 element"""
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(x)
+    return _POPCOUNT8[x.view(np.uint8)].reshape(*x.shape, 4).sum(axis=-1)
+
+def fingerprint_ber(query_fp, ref_fp, min_overlap=50, min_fraction=0.5):
+    """Lowest bit error rate of query_fp against ref_fp over all alignments
+    
+    Every offset whose overlap covers at least min_fraction of the shorter
+    fingerprint, and at least min_overlap frames (about 6 s), is compared at
+    once through a sliding window over the zero-padded reference, since a
+    Short can use any part of a song. Requiring a real share of the audio
+    keeps a shared intro or outro sting at the edges from counting as a match.
+    """
+    min_overlap = max(min_overlap, int(np.ceil(min_fraction * min(len(query_fp), len(ref_fp)))))
+    pad = len(query_fp) - min_overlap
+    if pad < 0 or len(ref_fp) < min_overlap:
+        return 1.0
+    padded = np.concatenate([np.zeros(pad, np.uint32), ref_fp, np.zeros(pad, np.uint32)])
+    valid = np.concatenate([np.zeros(pad, bool), np.ones(len(ref_fp), bool), np.zeros(pad, bool)])
+    
+    windows = np.lib.stride_tricks.sliding_window_view(padded, len(query_fp))
+    valid_windows = np.lib.stride_tricks.sliding_window_view(valid, len(query_fp))
+    frame_errors = _popcount32(np.bitwise_xor(windows, query_fp))
+    errors = np.where(valid_windows, frame_errors, 0).sum(axis=1, dtype=np.int64)
+    return float((errors / (32 * valid_windows.sum(axis=1))).min())
+
+def _fresh_fingerprints(cache):
+    """Stored (fingerprint, result, stored_at) entries younger than CACHE_TTL"""
+    cutoff = time.time() - CACHE_TTL
+    return [entry for entry in cache.get("fingerprints", []) if len(entry) == 3 and entry[2] >= cutoff]
+
+def identify_with_local_fingerprints(fingerprint, max_ber=0.35):
+    """Match a raw fingerprint against the fingerprints of earlier identifications"""
+    cache = _result_cache()
+    if fingerprint is None or cache is None:
+        return None
+    
+    for ref_fp, result, _ in _fresh_fingerprints(cache):
+        ber = fingerprint_ber(fingerprint, ref_fp)
+        if ber < max_ber:
+            logger.info("✅ Local fingerprint match: %s by %s (bit error rate %.2f)", result['title'], result['artist'], ber)
+            return result
+    return None
+
+def remember_fingerprint(fingerprint, result, max_entries=200):
+    """Add an identified fingerprint to the local database, newest first
+    
+    Each entry expires after CACHE_TTL like the other cached results.
+    """
+    cache = _result_cache()
+    if fingerprint is None or cache is None:
+        return
+    entries = _fresh_fingerprints(cache)
+    cache.set("fingerprints", [(fingerprint, result, time.time())] + entries[:max_entries - 1], expire=CACHE_TTL)
+
+def identify_with_acoustid(audio_path, api_key=None, min_score=0.5, fingerprint=None):
+    """Identify song locally with Chromaprint and one AcoustID lookup
+    
+    fingerprint is the raw chromaprint_raw fingerprint of audio_path; when
+    given, it is looked up as is instead of fingerprinting the file again.
+    Returns a result dict shaped like the ACRCloud ones, or None when AcoustID
+    is not configured or the best match scores below min_score.
+    """
+    api_key = api_key or os.getenv('ACOUSTID_API_KEY')
+    if not api_key:
+        return None
+    
+    try:
+        import acoustid
+    except ImportError:
+        logger.warning("⚠️  pyacoustid not installed, skipping AcoustID lookup")
+        return None
+    
+    try:
+        if fingerprint is not None:
+            logger.info("🧬 Querying AcoustID with the Chromaprint fingerprint...")
+            response = acoustid.lookup(api_key, encode_chromaprint(fingerprint), get_audio_duration(audio_path))
+            matches = list(acoustid.parse_lookup_result(response))
+        else:
+            logger.info("🧬 Fingerprinting with Chromaprint and querying AcoustID...")
+            matches = list(acoustid.match(api_key, str(audio_path)))
+    except acoustid.AcoustidError as e:
+        logger.warning("⚠️  AcoustID lookup failed: %s", e)
         return None
+    
+    if not matches:
+        logger.warning("⚠️  No AcoustID match")
+        return None
+    
+    score, recording_id, title, artist = max(matches, key=lambda m: m[0])
+    if score < min_score:
+        logger.warning("⚠️  AcoustID match too weak (score %.2f)", score)
+        return None
+    
+    logger.info("✅ AcoustID match: %s by %s (score %.2f)", title, artist, score)
+    return {
+        'title': title or 'Unknown',
+        'artist': artist or 'Unknown',
+        'album': 'Unknown',
+        'genre': 'Unknown',
+        'confidence': round(score * 100),  # Same 0-100 scale as ACRCloud
+        'segment': 'full'
+    }
 
-def identify_with_acrcloud_improved(audio_path, access_key=None, access_secret=None, host=None):
-    """Identify song using enhanced ACRCloud REST API with multiple segment testing"""
+def identify_with_acrcloud_improved(audio_path, access_key=None, access_secret=None, host=None, start_times=None):
+    """Identify song using enhanced ACRCloud REST API with multiple segment testing
+    
+    start_times overrides the evenly spread segment start times, e.g. for audio
+    that was already trimmed to the planned segment windows.
+    """
     # Use provided values or fall back to environment variables
     access_key = access_key or os.getenv('ACRCLOUD_ACCESS_KEY')
     access_secret = access_secret or os.getenv('ACRCLOUD_ACCESS_SECRET')
     host = host or os.getenv('ACRCLOUD_HOST')
     
     if not access_key or not access_secret or not host:
-        print("❌ ACRCloud credentials not found!")
-        print("💡 Set ACRCLOUD_ACCESS_KEY, ACRCLOUD_ACCESS_SECRET, and ACRCLOUD_HOST in your .env file")
+        logger.error("❌ ACRCloud credentials not found!")
+        logger.error("💡 Set ACRCLOUD_ACCESS_KEY, ACRCLOUD_ACCESS_SECRET, and ACRCLOUD_HOST in your .env file")
         return None
     
-    print("🎵 Identifying with ACRCloud REST API...")
-    print(f"📁 Using audio file: {audio_path}")
+    # Same audio bytes, same answer: skip the uploads on a cache hit
+    cache = _result_cache()
+    cache_key = f"audio:{hash_audio_file(audio_path)}" if cache is not None else None
+    if cache is not None and cache_key in cache:
+        best_match = cache[cache_key]
+        logger.info("💾 Using cached identification for %s", audio_path)
+        return best_match
+    
+    logger.info("🎵 Identifying with ACRCloud REST API...")
+    logger.info("📁 Using audio file: %s", audio_path)
     
     # Get file size and duration
     sample_bytes = os.path.getsize(str(audio_path))
     duration = get_audio_duration(audio_path)
     
-    print(f"📊 File size: {sample_bytes} bytes")
-    print(f"⏱️  Duration: {duration:.1f} seconds")
+    logger.info("📊 File size: %s bytes", sample_bytes)
+    logger.info("⏱️  Duration: %.1f seconds", duration)
     
     # Always extract multiple segments for better testing
-    print("📦 Extracting multiple 20-second segments for testing...")
+    logger.info("📦 Extracting multiple 20-second segments for testing...")
     
-    # Calculate how many segments we can extract
-    max_segments = min(5, int(duration // 20))  # Test up to 5 segments
-    if max_segments < 1:
-        print("❌ Audio file too short to extract segments")
+    if start_times is None:
+        start_times = plan_segment_start_times(duration)
+    if not start_times:
+        logger.error("❌ Audio file too short to extract segments")
         return None
-        
-    print(f"🎯 Will test {max_segments} 20-second segments")
     
-    # Generate start times (spread evenly across the audio)
-    start_times = []
-    available_duration = duration - 20  # Leave room for 20-second segment
+    max_segments = len(start_times)
+    logger.info("🎯 Will test %s 20-second segments", max_segments)
     
-    if available_duration <= 0:
-        print("❌ Audio file too short")
-        return None
+    logger.info("🎵 Segment start times: %s", [f'{t:.1f}s' for t in start_times])
     
-    # Generate evenly spaced start times
-    for i in range(max_segments):
-        # Spread segments across the audio, avoiding the very beginning and end
-        start_time = 5 + (i * (available_duration - 10) / max_segments)
-        start_times.append(start_time)
+    # Producer/consumer: cut each segment and hand it to the upload pool right
+    # away, so ffmpeg work on segment N+1 overlaps the network wait for segment N
+    # ACRCloud fingerprints at 8 kHz mono anyway, so upload small mono MP3s
+    # (UPLOAD_SAMPLE_RATE=0 stream-copies in the source container instead)
+    downsample = UPLOAD_SAMPLE_RATE > 0
+    suffix = ".mp3" if downsample else Path(audio_path).suffix
+    sig_ctx = build_signature_context(access_key, access_secret, host)
+    warm_connection(host)
     
-    print(f"🎵 Segment start times: {[f'{t:.1f}s' for t in start_times]}")
-    
-    # Test each segment
-    results = []
-    for i, start_time in enumerate(start_times):
-        print(f"\n🎵 Testing segment {i+1}/{max_segments} (starting at {start_time:.1f}s)...")
-        
-        # Create temporary segment file
-        segment_path = Path(f"segment_{i+1}.mp3")
-        
-        # Extract segment
-        if not extract_audio_segment(audio_path, segment_path, start_time, 20):
-            print(f"❌ Failed to extract segment {i+1}")
-            continue
-        
-        # Test this segment
-        result = test_single_segment(segment_path, access_key, access_secret, host, i+1)
-        
-        # Clean up segment file
-        try:
-            segment_path.unlink()
-        except:
-            pass
-        
-        if result:
-            results.append(result)
+    # One short upload from one of the loudest windows usually settles it; the full
+    # fan-out only runs when the probe is not a confident match
+    probe = probe_first_window(audio_path, start_times[0], sig_ctx, downsample, suffix) if PROBE_SECONDS > 0 else None
+    if probe and is_confident(probe, PROBE_MIN_CONFIDENCE):
+        logger.info("⏩ Confident match on the %ss probe, skipping the %s full segments", PROBE_SECONDS, max_segments)
+        results = [probe]
+    else:
+        # A weak probe match still counts if the full segments find nothing better
+        results = ([probe] if probe else []) + test_segments(audio_path, start_times, sig_ctx, downsample, suffix)
     
     # Display summary of results
-    print("\n" + "="*60)
-    print("📊 IDENTIFICATION RESULTS")
-    print("="*60)
+    logger.info("\n" + "="*60)
+    logger.info("📊 IDENTIFICATION RESULTS")
+    logger.info("="*60)
     
     if results:
-        print(f"✅ Found {len(results)} successful matches!")
-        print()
+        logger.info("✅ Found %s successful matches!", len(results))
+        logger.info("")
         
         # Group by song (in case multiple segments match the same song)
         unique_songs = {}
         for result in results:
-            song_key = f"{result['title']}_{result['artist']}"
-            if song_key not in unique_songs:
+            song_key = (result['title'], result['artist'])
+            # Keep the one with higher confidence
+            best = unique_songs.get(song_key)
+            if best is None or confidence_score(result) > confidence_score(best):
                 unique_songs[song_key] = result
-            else:
-                # Keep the one with higher confidence
-                if result['confidence'] > unique_songs[song_key]['confidence']:
-                    unique_songs[song_key] = result
         
-        print(f"🎵 Unique songs found: {len(unique_songs)}")
-        print()
+        logger.info("🎵 Unique songs found: %s", len(unique_songs))
+        logger.info("")
         
         for i, (song_key, song) in enumerate(unique_songs.items(), 1):
-            print(f"🎵 Song {i}:")
-            print(f"   Title: {song['title']}")
-            print(f"   Artist: {song['artist']}")
-            print(f"   Album: {song['album']}")
-            print(f"   Genre: {song['genre']}")
-            print(f"   Confidence: {song['confidence']}")
-            print(f"   Matched in segment: {song['segment']}")
-            print()
+            logger.info("🎵 Song %s:", i)
+            logger.info("   Title: %s", song['title'])
+            logger.info("   Artist: %s", song['artist'])
+            logger.info("   Album: %s", song['album'])
+            logger.info("   Genre: %s", song['genre'])
+            logger.info("   Confidence: %s", song['confidence'])
+            logger.info("   Matched in segment: %s", song['segment'])
+            logger.info("")
         
         # Return the best match (highest confidence)
-        best_match = max(unique_songs.values(), key=lambda x: x['confidence'])
+        best_match = max(unique_songs.values(), key=confidence_score)
+        if cache is not None:
+            cache.set(cache_key, best_match, expire=CACHE_TTL)
         return best_match
     else:
-        print("❌ No music identified in any segment")
-        print("\n💡 This could mean:")
-        print("   • The audio contains mostly speech/dialogue")
-        print("   • The music is too quiet or obscured")
-        print("   • The song is not in ACRCloud's database")
-        print("   • The audio quality is too low")
-        print("   • The vocal removal didn't work well")
+        logger.error("❌ No music identified in any segment")
+        logger.info("\n💡 This could mean:")
+        logger.info("   • The audio contains mostly speech/dialogue")
+        logger.info("   • The music is too quiet or obscured")
+        logger.info("   • The song is not in ACRCloud's database")
+        logger.info("   • The audio quality is too low")
+        logger.info("   • The vocal removal didn't work well")
         return None
 
-def test_single_segment(audio_path, access_key, access_secret, host, segment_num):
-    """Test a single audio segment with ACRCloud"""
+def confidence_score(result):
+    """A match's numeric ACRCloud score, with 'Unknown' ranked below any score"""
+    confidence = result['confidence']
+    return confidence if isinstance(confidence, (int, float)) else -1
+
+def is_confident(result, min_confidence):
+    """True for a match whose numeric ACRCloud score reaches min_confidence"""
+    return confidence_score(result) >= min_confidence
+
+def probe_first_window(audio_path, start_time, sig_ctx, downsample, suffix):
+    """Upload the middle PROBE_SECONDS of the first segment window
+    
+    Returns the match, or None when the probe did not identify anything.
+    """
+    probe_path = Path(f"segment_probe{suffix}")
+    probe_start = start_time + (20 - PROBE_SECONDS) / 2
+    logger.info("🔎 Probing %ss of segment 1 (starting at %.1fs)...", PROBE_SECONDS, probe_start)
+    if not extract_audio_segment(audio_path, probe_path, probe_start, PROBE_SECONDS, downsample):
+        return None
     try:
-        # Build the request URL
-        requrl = f"https://{host}/v1/identify"
-        
-        # HTTP method and URI
-        http_method = "POST"
-        http_uri = "/v1/identify"
-        data_type = "audio"
-        signature_version = "1"
-        timestamp = time.time()
-        
-        # Create signature string
-        string_to_sign = (http_method + "\n" + http_uri + "\n" + access_key + "\n" + 
-                         data_type + "\n" + signature_version + "\n" + str(timestamp))
-        
-        # Generate signature
-        sign = base64.b64encode(
-            hmac.new(access_secret.encode('ascii'), 
-                    string_to_sign.encode('ascii'),
-                    digestmod=hashlib.sha1).digest()
-        ).decode('ascii')
-        
-        # Get file size
-        sample_bytes = os.path.getsize(str(audio_path))
-        
-        # Prepare files and data for upload
-        files = [
-            ('sample', (audio_path.name, open(str(audio_path), 'rb'), 'audio/mpeg'))
-        ]
-        
-        data = {
-            'access_key': access_key,
-            'sample_bytes': sample_bytes,
-            'timestamp': str(timestamp),
-            'signature': sign,
-            'data_type': data_type,
-            'signature_version': signature_version
-        }
-        
-        print(f"📤 Uploading {sample_bytes} bytes to ACRCloud...")
-        
-        # Make the request
-        r = requests.post(requrl, files=files, data=data, timeout=30)
-        r.encoding = "utf-8"
+        result, log = test_single_segment(probe_path, sig_ctx, 1)
+    finally:
+        try:
+            probe_path.unlink()
+        except OSError:
+            pass
+    logger.info("%s", "\n".join(f"   {line}" for line in log))
+    return result
+
+def test_segments(audio_path, start_times, sig_ctx, downsample, suffix):
+    """Cut and upload every 20-second segment in parallel; returns the matches in segment order"""
+    max_segments = len(start_times)
+    results = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_segments) as ex:
+        futures = {}
+        for i, start_time in enumerate(start_times):
+            segment_path = Path(f"segment_{i+1}{suffix}")
+            logger.info("✂️  Extracting segment %s/%s (starting at %.1fs)...", i+1, max_segments, start_time)
+            if not extract_audio_segment(audio_path, segment_path, start_time, 20, downsample):
+                logger.error("❌ Failed to extract segment %s", i+1)
+                continue
+            futures[ex.submit(test_single_segment, segment_path, sig_ctx, i+1)] = (segment_path, i+1)
         
-        # Parse JSON response
+        logs = {}
+        for future in concurrent.futures.as_completed(futures):
+            segment_path, segment_num = futures[future]
+            result = None
+            try:
+                result, logs[segment_num] = future.result()
+            finally:
+                # Clean up segment file
+                try:
+                    segment_path.unlink()
+                except OSError:
+                    pass
+            
+            if result:
+                results.append(result)
+    
+    # Print each segment's log as one block, in segment order
+    for segment_num in sorted(logs):
+        logger.info("\n🎵 Segment %s/%s:\n%s", segment_num, max_segments,
+                    "\n".join(f"   {line}" for line in logs[segment_num]))
+    
+    # Keep the summary in segment order regardless of completion order
+    results.sort(key=lambda r: r['segment'])
+    return results
+
+def warm_connection(host, session=None):
+    """Open a keep-alive connection to host on a daemon thread
+    
+    DNS lookup and TLS handshake then overlap the first segment's ffmpeg
+    cut, and the first upload takes the ready connection from the pool.
+    """
+    session = session or _SESSION
+    
+    def connect():
         try:
-            result = json.loads(r.text)
+            session.head(f"https://{host}/", timeout=5)
+        except requests.RequestException:
+            pass  # The upload reports real connection problems
+    
+    threading.Thread(target=connect, daemon=True).start()
+
+@lru_cache(maxsize=4)
+def _hmac_prototype(access_secret):
+    """Keyed HMAC-SHA1 for a secret; copy() it so the key schedule runs once"""
+    return hmac.new(access_secret.encode('ascii'), digestmod='sha1')
+
+@lru_cache(maxsize=4)
+def _string_to_sign_prefix(access_key):
+    """Everything in the string-to-sign except the trailing timestamp"""
+    return b"POST\n/v1/identify\n" + access_key.encode('ascii') + b"\naudio\n1\n"
+
+def build_signature_context(access_key, access_secret, host):
+    """Sign one ACRCloud identify request window.
+    
+    The signature only depends on the credentials and the timestamp, so all
+    segments of one identification run share it; they are sent within a few
+    seconds, well inside ACRCloud's timestamp validity window.
+    """
+    http_uri = "/v1/identify"
+    timestamp = str(time.time())
+    
+    # Only the timestamp changes between signatures
+    string_to_sign = _string_to_sign_prefix(access_key) + timestamp.encode('ascii')
+    mac = _hmac_prototype(access_secret).copy()
+    mac.update(string_to_sign)
+    
+    # Generate signature (the form field needs text, so decode the base64 once)
+    sign = base64.b64encode(mac.digest()).decode('ascii')
+    
+    return {
+        'requrl': f"https://{host}{http_uri}",
+        'access_key': access_key,
+        'timestamp': timestamp,
+        'signature': sign,
+        'data_type': "audio",
+        'signature_version': "1"
+    }
+
+def parse_acrcloud_response(content, segment_num):
+    """Parse an ACRCloud identify response body into (result, log)
+    
+    result is None when the response has no music or reports an error.
+    """
+    try:
+        response = json_loads(content)  # Parse the raw bytes, no text decode pass
+    except json.JSONDecodeError as e:
+        return None, [f"❌ Invalid JSON response: {e}"]
+    
+    status = response.get('status', {})
+    if status.get('code') != 0:
+        log = [f"❌ API Error: {status.get('msg', 'Unknown error')}"]
+        if status.get('code') == 3014:  # Invalid signature
+            log.append("💡 This might be a credential issue - check your .env file")
+            log.append("💡 Make sure you're using the Access Key (not Secret Key) from ACRCloud")
+        return None, log
+    
+    if not response.get('metadata', {}).get('music'):
+        return None, ["⚠️  No music found in this segment"]
+    
+    music = response['metadata']['music'][0]
+    result = {
+        'title': music.get('title', 'Unknown'),
+        'artist': music.get('artists', [{}])[0].get('name', 'Unknown'),
+        'album': music.get('album', {}).get('name', 'Unknown'),
+        'genre': music.get('genres', [{}])[0].get('name', 'Unknown'),
+        'confidence': music.get('score', 'Unknown'),
+        'segment': segment_num
+    }
+    return result, [
+        "✅ SUCCESS: Song identified!",
+        f"🎵 Title: {result['title']}",
+        f"👤 Artist: {result['artist']}",
+        f"📀 Album: {result['album']}",
+        f"🎼 Genre: {result['genre']}",
+        f"🎯 Confidence: {result['confidence']}",
+    ]
+
+def test_single_segment(audio_path, sig_ctx, segment_num):
+    """Test a single audio segment with ACRCloud using a shared signature context
+    
+    Returns (result, log): output lines are collected instead of printed so
+    parallel uploads do not interleave on stdout.
+    """
+    log = []
+    try:
+        # Stream the segment from disk instead of buffering it for the request
+        # body. The encoder must get the file object itself: it tracks how much
+        # of a file is left, but takes an mmap's len() as the bytes remaining,
+        # which never shrinks, so reading it would spin forever at the end
+        with open(str(audio_path), 'rb') as fh:
+            sample_bytes = os.fstat(fh.fileno()).st_size
             
-            # Check status
-            status = result.get('status', {})
-            if status.get('code') == 0:
-                if result.get('metadata', {}).get('music'):
-                    print("✅ SUCCESS: Song identified!")
-                    music = result['metadata']['music'][0]
-                    print(f"🎵 Title: {music.get('title', 'Unknown')}")
-                    print(f"👤 Artist: {music.get('artists', [{}])[0].get('name', 'Unknown')}")
-                    print(f"📀 Album: {music.get('album', {}).get('name', 'Unknown')}")
-                    print(f"🎼 Genre: {music.get('genres', [{}])[0].get('name', 'Unknown')}")
-                    print(f"🎯 Confidence: {music.get('score', 'Unknown')}")
-                    return {
-                        'title': music.get('title', 'Unknown'),
-                        'artist': music.get('artists', [{}])[0].get('name', 'Unknown'),
-                        'album': music.get('album', {}).get('name', 'Unknown'),
-                        'genre': music.get('genres', [{}])[0].get('name', 'Unknown'),
-                        'confidence': music.get('score', 'Unknown'),
-                        'segment': segment_num
-                    }
-                else:
-                    print("⚠️  No music found in this segment")
-                    return None
-            else:
-                print(f"❌ API Error: {status.get('msg', 'Unknown error')}")
-                if status.get('code') == 3014:  # Invalid signature
-                    print("💡 This might be a credential issue - check your .env file")
-                    print("💡 Make sure you're using the Access Key (not Secret Key) from ACRCloud")
-                return None
-                
-        except json.JSONDecodeError as e:
-            print(f"❌ Invalid JSON response: {e}")
-            return None
+            encoder = MultipartEncoder(fields={
+                'access_key': sig_ctx['access_key'],
+                'sample_bytes': str(sample_bytes),
+                'timestamp': sig_ctx['timestamp'],
+                'signature': sig_ctx['signature'],
+                'data_type': sig_ctx['data_type'],
+                'signature_version': sig_ctx['signature_version'],
+                'sample': (audio_path.name, fh, mimetypes.guess_type(audio_path.name)[0] or 'application/octet-stream')
+            })
+            
+            log.append(f"📤 Uploading {sample_bytes} bytes to ACRCloud...")
             
+            # Make the request
+            r = _SESSION.post(sig_ctx['requrl'], data=encoder, headers={'Content-Type': encoder.content_type}, timeout=30)
+        
+        result, response_log = parse_acrcloud_response(r.content, segment_num)
+        return result, log + response_log
+    
     except Exception as e:
-        print(f"❌ Error: {e}")
-        return None
+        log.append(f"❌ Error: {e}")
+        return None, log
+
+def prepare_separated_audio(audio_path, start_times, cancel=None):
+    """Trim to the analysis windows and remove vocals
+    
+    Returns (no_vocals_path, start_times) with the start times mapped onto the
+    separated file, or (None, None) if separation failed. cancel is an
+    optional threading.Event checked between the trim and separator stages,
+    so a background separation stops early once its result is not needed.
+    """
+    # Only separate the windows we will sample
+    separation_input, trimmed_start_times = trim_audio_to_segments(audio_path, start_times)
+    if separation_input:
+        logger.info("✂️  Trimmed audio to the analysis windows: %s", separation_input)
+    else:
+        separation_input, trimmed_start_times = audio_path, start_times
+    
+    if cancel is not None and cancel.is_set():
+        return None, None
+    no_vocals_path = remove_speech(separation_input, cancel)
+    if not no_vocals_path or not no_vocals_path.exists():
+        return None, None
+    return no_vocals_path, trimmed_start_times
+
+def _run_in_background(fn, *args):
+    """Run fn(*args) on a daemon thread and return a Future for its result
+    
+    Unlike ThreadPoolExecutor workers, a daemon thread does not hold up
+    interpreter exit when its result ends up not being needed.
+    """
+    future = concurrent.futures.Future()
+    
+    def runner():
+        try:
+            future.set_result(fn(*args))
+        except BaseException as e:
+            future.set_exception(e)
+    
+    threading.Thread(target=runner, daemon=True).start()
+    return future
+
+def _pid_alive(pid):
+    """True if a process with this pid is running (or cannot be checked)"""
+    if os.name == "nt":
+        # os.kill would terminate the process on Windows, so ask for a handle
+        import ctypes
+        handle = ctypes.windll.kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return False
+        ctypes.windll.kernel32.CloseHandle(handle)
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True  # Exists, owned by another user
+    return True
 
 def cleanup_existing_files():
-    """Delete existing MP3 files and other temporary files"""
-    print("🧹 Cleaning up existing files...")
-    
-    # Files to delete
-    files_to_delete = [
-        "audio.mp3",
-        "audio.wav", 
-        "no_vocals.mp3",
-        "no_vocals.wav",
-        "video.mp4",
-        "video.webm",
-        "video.mkv"
+    """Delete downloaded audio, segments and other temporary files"""
+    logger.info("🧹 Cleaning up existing files...")
+    
+    # A single directory scan, matching each name against all patterns
+    patterns = [
+        "audio.*",
+        "audio_*.*",  # Batch and --serve downloads, trimmed copies and trim parts/lists
+        "no_vocals.*",
+        "video.*",
+        "segment_*.*"
     ]
     
     deleted_count = 0
-    for file_name in files_to_delete:
-        file_path = Path(file_name)
-        if file_path.exists():
+    failed = []
+    with os.scandir(".") as entries:
+        for entry in entries:
+            if not any(fnmatch.fnmatchcase(entry.name, pattern) for pattern in patterns):
+                continue
             try:
-                file_path.unlink()
-                print(f"🗑️  Deleted: {file_name}")
+                os.unlink(entry.path)
                 deleted_count += 1
-            except Exception as e:
-                print(f"⚠️  Could not delete {file_name}: {e}")
+            except FileNotFoundError:
+                pass
+            except OSError:
+                failed.append(entry.name)
     
-    # Also clean up separated folder if it exists
-    separated_dir = Path("separated")
-    if separated_dir.exists():
-        try:
-            import shutil
-            shutil.rmtree(separated_dir)
-            print("🗑️  Deleted: separated/ folder")
-            deleted_count += 1
-        except Exception as e:
-            print(f"⚠️  Could not delete separated/ folder: {e}")
+    # Move separated/ out of the way (one rename) and delete it on a daemon
+    # thread, so the tree walk overlaps the URL prompt. The unique name keeps
+    # repeated cleanups (--serve) from colliding with a delete still running.
+    # Leftovers of runs that exited before their delete finished are picked
+    # up here too, but not those of pipelines still running in this directory
+    stale_dirs = []
+    try:
+        moved = Path(f"separated.old-{os.getpid()}-{time.time_ns()}")
+        Path("separated").rename(moved)
+        stale_dirs.append(moved)
+        deleted_count += 1
+    except FileNotFoundError:
+        pass
+    except OSError:
+        failed.append("separated/")
+    for old_dir in Path(".").glob("separated.old-*"):
+        match = re.fullmatch(r"separated\.old-(\d+)(?:-\d+)?", old_dir.name)
+        if match and not _pid_alive(int(match.group(1))):
+            stale_dirs.append(old_dir)
+    if stale_dirs:
+        threading.Thread(
+            target=lambda: [shutil.rmtree(d, ignore_errors=True) for d in stale_dirs],
+            daemon=True
+        ).start()
     
+    if failed:
+        logger.warning("⚠️  Could not delete: %s", ', '.join(failed))
     if deleted_count > 0:
-        print(f"✅ Cleaned up {deleted_count} files/folders")
+        logger.info("✅ Cleaned up %s files/folders", deleted_count)
     else:
-        print("✅ No files to clean up")
+        logger.info("✅ No files to clean up")
 
-def main():
-    print("🎵 YouTube Short to Music Identification")
-    print("=" * 50)
-    
-    # Clean up existing files first
-    cleanup_existing_files()
-    print()
-    
-    # Get YouTube URL
-    url = input("Enter YouTube Short URL: ").strip()
+def print_song_result(result):
+    """Print the final identification result"""
+    print("\n🎉 SUCCESS! Song identified:")
+    print("=" * 40)
+    print(f"🎵 Title: {result.get('title', 'Unknown')}")
+    print(f"👤 Artist: {result.get('artist', 'Unknown')}")
+    print(f"📀 Album: {result.get('album', 'Unknown')}")
+    print(f"🎼 Genre: {result.get('genre', 'Unknown')}")
+    print(f"🎯 Confidence: {result.get('confidence', 'Unknown')}")
+    print("=" * 40)
+
+def cached_video_result(url):
+    """Return the cached identification for a URL's video ID, or None"""
+    video_id = extract_video_id(url)
+    cache = _result_cache()
+    if cache is None or not video_id:
+        return None
+    return cache.get(f"video:{video_id}")
+
+def identify_url(url, download=None, outtmpl='audio.%(ext)s'):
+    """Run the full pipeline for one URL and print the result
     
-    if not url:
-        print("❌ No URL provided")
+    download is an optional Future for an audio download that was already
+    started in the background; otherwise the audio is downloaded here, to
+    outtmpl. Returns the Future of a background separation that may still be
+    running (cancelled once a match is found), or None.
+    """
+    # Repeat URLs skip the whole pipeline, download included
+    video_id = extract_video_id(url)
+    cache = _result_cache()
+    video_key = f"video:{video_id}" if video_id else None
+    cached = cached_video_result(url)
+    if cached:
+        logger.info("💾 Using cached identification for video %s", video_id)
+        print_song_result(cached)
         return
     
-    # Check if yt-dlp is available
-    if not check_yt_dlp():
-        print("❌ yt-dlp not found. Installing...")
-        try:
-            subprocess.run([sys.executable, "-m", "pip", "install", "yt-dlp"], check=True)
-            print("✅ yt-dlp installed successfully")
-        except subprocess.CalledProcessError:
-            print("❌ Failed to install yt-dlp")
-            print("💡 Install manually: pip install yt-dlp")
-            return
-    
     # Download audio directly
-    audio_path = download_with_yt_dlp(url)
+    audio_path = download.result() if download else download_with_yt_dlp(url, outtmpl)
     if not audio_path:
         return
     
-    print(f"\n✅ Audio downloaded to: {audio_path}")
+    logger.info("\n✅ Audio downloaded to: %s", audio_path)
     
-    # Check if ACRCloud credentials are available
-    acrcloud_key = os.getenv('ACRCLOUD_ACCESS_KEY')
-    acrcloud_secret = os.getenv('ACRCLOUD_ACCESS_SECRET')
-    acrcloud_host = os.getenv('ACRCLOUD_HOST')
+    # One fpcalc run feeds both the local matches and the AcoustID lookup; it
+    # decodes the audio in the background while the segments are planned
+    fingerprinting = _run_in_background(chromaprint_raw, audio_path)
     
-    if acrcloud_key and acrcloud_secret and acrcloud_host:
-        print(f"✅ ACRCloud credentials found in .env file")
-        print(f"   Host: {acrcloud_host}")
-    else:
-        print("⚠️  ACRCloud credentials not found in .env file")
+    no_vocals_path = None
+    duration = get_audio_duration(audio_path)
+    start_times = plan_loudest_start_times(audio_path, duration)
     
-    print("\n🎯 Choose your approach:")
-    print("1. 🎵 Use original audio with ACRCloud")
-    print("2. 🔇 Remove vocals with Demucs, then use ACRCloud")
+    # Cheapest path: the same song from an earlier Short, matched locally
+    fingerprint = fingerprinting.result()
+    result = identify_with_local_fingerprints(fingerprint)
     
-    choice = input("\nEnter your choice (1-2): ").strip()
+    # Next: the AcoustID lookup (one request, free of API quota), if configured
+    if not result:
+        result = identify_with_acoustid(audio_path, fingerprint=fingerprint)
     
-    if choice == "1":
-        # Use original audio
-        print("\n🎵 Identifying with original audio...")
-        print(f"🎯 Using original audio file: {audio_path}")
-        result = identify_with_acrcloud_improved(audio_path)
+    # Separate vocals on a background thread while the original audio is tried,
+    # so the fallback path does not start from scratch after a miss
+    separation = None
+    cancel_separation = threading.Event()
+    if not result and SEPARATE_IN_BACKGROUND and SEPARATOR != "none":
+        logger.info("\n🔇 Removing vocals in the background while trying the original audio...")
+        separation = _run_in_background(prepare_separated_audio, audio_path, start_times, cancel_separation)
     
-    elif choice == "2":
-        # Remove vocals first
-        print("\n🔇 Step 1: Removing vocals with Demucs...")
-        no_vocals_path = remove_speech_demucs(audio_path)
-        
-        if not no_vocals_path or not no_vocals_path.exists():
-            print("❌ Could not remove vocals")
-            print("💡 Falling back to original audio...")
-            no_vocals_path = audio_path
-        
-        # Identify with processed audio
-        print("\n🎵 Step 2: Identifying song...")
-        print(f"🎯 Using vocals-removed file: {no_vocals_path}")
-        result = identify_with_acrcloud_improved(no_vocals_path)
+    # Fast path: ACRCloud often matches the original mix, which skips separation
+    if not result:
+        logger.info("\n🎵 Step 1: Identifying with original audio...")
+        logger.info("🎯 Using original audio file: %s", audio_path)
+        result = identify_with_acrcloud_improved(audio_path, start_times=start_times)
     
+    if result:
+        # Stop the background separation at its next stage; nothing will use it
+        cancel_separation.set()
+        logger.info("\n⏩ Matched on the original audio, vocal removal not needed")
+    elif SEPARATOR == "none":
+        logger.info("\n⏭️  No match on the original audio, vocal removal is disabled (SEPARATOR=none)")
     else:
-        print("❌ Invalid choice")
-        return
+        logger.info("\n🔁 No match on the original audio, retrying without vocals...")
+        
+        logger.info("\n🔇 Step 2: Removing vocals...")
+        if separation:
+            no_vocals_path, trimmed_start_times = separation.result()
+        else:
+            no_vocals_path, trimmed_start_times = prepare_separated_audio(audio_path, start_times)
+        
+        if not no_vocals_path:
+            logger.error("❌ Could not remove vocals")
+        else:
+            # Identify with processed audio
+            logger.info("\n🎵 Step 3: Identifying song...")
+            logger.info("🎯 Using vocals-removed file: %s", no_vocals_path)
+            result = identify_with_acrcloud_improved(no_vocals_path, start_times=trimmed_start_times)
+            if result:
+                # Remember the music that matched, not the mix with dialogue over it
+                fingerprint = chromaprint_raw(no_vocals_path)
     
     # Handle results
     if result:
-        print("\n🎉 SUCCESS! Song identified:")
-        print("=" * 40)
-        print(f"🎵 Title: {result.get('title', 'Unknown')}")
-        print(f"👤 Artist: {result.get('artist', 'Unknown')}")
-        print(f"📀 Album: {result.get('album', 'Unknown')}")
-        print(f"🎼 Genre: {result.get('genre', 'Unknown')}")
-        print(f"🎯 Confidence: {result.get('confidence', 'Unknown')}")
-        print("=" * 40)
+        if cache is not None and video_key:
+            cache.set(video_key, result, expire=CACHE_TTL)
+        remember_fingerprint(fingerprint, result)
+        print_song_result(result)
     else:
         print("\n❌ No music identified")
         print("\n💡 This could mean:")
@@ -485,24 +1484,150 @@ def main():
         print("   • The audio quality is too low")
         
         print("\n🔄 Try these solutions:")
-        print("   1. Try option 2 (remove vocals first)")
-        print("   2. Try with a different YouTube Short")
-        print("   3. Check if the audio actually contains music")
+        print("   1. Try with a different YouTube Short")
+        print("   2. Check if the audio actually contains music")
     
-    print("\n🎉 Process completed!")
-    print("\n💡 Get free ACRCloud API key from: https://www.acrcloud.com/")
+    logger.info("\n🎉 Process completed!")
+    logger.info("\n💡 Get free ACRCloud API key from: https://www.acrcloud.com/")
     
     # Always show manual verification option
-    print("\n" + "="*60)
-    print("🔍 MANUAL VERIFICATION")
-    print("="*60)
-    print("Was the song not found? Or is the result incorrect?")
-    print("Try this manual approach:")
-    print(f"1. Navigate to: {Path.cwd() / 'separated' / 'htdemucs' / 'audio' / 'no_vocals.mp3'}")
-    print("2. Play this file on your computer at loud volume")
-    print("3. Open the Shazam app on your phone")
-    print("4. Let Shazam listen to the background music")
-    print("="*60)
+    logger.info("\n" + "="*60)
+    logger.info("🔍 MANUAL VERIFICATION")
+    logger.info("="*60)
+    logger.info("Was the song not found? Or is the result incorrect?")
+    logger.info("Try this manual approach:")
+    # Point at the separated music when vocal removal ran, otherwise the original
+    logger.info("1. Navigate to: %s", Path.cwd() / (no_vocals_path or audio_path))
+    logger.info("2. Play this file on your computer at loud volume")
+    logger.info("3. Open the Shazam app on your phone")
+    logger.info("4. Let Shazam listen to the background music")
+    logger.info("="*60)
+    
+    # A cancelled separation still finishes its current stage; it runs on a
+    # daemon thread, so only callers that clean up after it need to wait
+    return separation
+
+def serve_urls():
+    """Identify URLs read from stdin, one per line, in this one process
+    
+    torch, the Demucs model (once loaded), the cache and the keep-alive
+    session stay loaded between URLs, so only the first one pays for them.
+    """
+    logger.info("\n✅ Reading YouTube Short URLs from stdin, one per line (Ctrl+D to stop)")
+    try:
+        n = 0
+        separation = None
+        for line in sys.stdin:
+            url = line.strip()
+            if not url:
+                continue
+            n += 1
+            logger.info("\n" + "#"*60)
+            logger.info("🎬 [%s] %s", n, url)
+            logger.info("#"*60)
+            # The cleanup would delete files the last URL's separation is still
+            # using, so let it finish its current stage first; each URL still
+            # gets its own file names
+            if separation:
+                concurrent.futures.wait([separation])
+            cleanup_existing_files()
+            separation = identify_url(url, outtmpl=f"audio_{n}.%(ext)s")
+    except KeyboardInterrupt:
+        logger.info("\n👋 Stopped")
+
+def main():
+    global USE_CACHE
+    parser = argparse.ArgumentParser(description="Identify the music in YouTube Shorts with dialogue over it")
+    parser.add_argument("urls", nargs="*", metavar="URL",
+                        help="YouTube Short URLs to identify as a batch (prompts for one if omitted)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="ignore and do not update the result cache")
+    parser.add_argument("--serve", action="store_true",
+                        help="read URLs from stdin, one per line, keeping models loaded between them")
+    parser.add_argument("--demucs-server", action="store_true",
+                        help="run the Demucs worker that keeps torch and the model loaded")
+    args = parser.parse_args()
+    if args.urls and (args.serve or args.demucs_server):
+        parser.error("URLs cannot be combined with --serve or --demucs-server")
+    if args.no_cache:
+        USE_CACHE = False
+    if args.demucs_server:
+        serve_demucs()
+        return
+    serve = args.serve
+    
+    logger.info("🎵 YouTube Short to Music Identification")
+    logger.info("=" * 50)
+    
+    # Clean up existing files first
+    cleanup_existing_files()
+    logger.info("")
+    
+    # URLs from the command line are processed as a batch, otherwise prompt for
+    # one; with --serve they are read from stdin instead
+    if serve:
+        urls = []
+    else:
+        urls = [url.strip() for url in args.urls] or [input("Enter YouTube Short URL: ").strip()]
+        urls = [url for url in urls if url]
+    
+    if not urls and not serve:
+        logger.error("❌ No URL provided")
+        return
+    
+    # Hide the torch/Demucs import behind the download in case separation is
+    # needed; a running Demucs worker already has it loaded. The checkpoint is
+    # only loaded (and downloaded on first use) when Demucs is the separator,
+    # since with SEPARATOR=auto UVR runs first and most Shorts never separate
+    if SEPARATOR in ("auto", "demucs") and not Path(DEMUCS_SOCKET).exists():
+        threading.Thread(target=_preload_demucs, args=(SEPARATOR == "demucs",), daemon=True).start()
+    
+    # Check if yt-dlp is available
+    if not check_yt_dlp():
+        logger.warning("⚠️  yt-dlp not found. Installing...")
+        try:
+            subprocess.run([sys.executable, "-m", "pip", "install", "yt-dlp"], check=True)
+            logger.info("✅ yt-dlp installed successfully")
+        except subprocess.CalledProcessError:
+            logger.error("❌ Failed to install yt-dlp")
+            logger.error("💡 Install manually: pip install yt-dlp")
+            return
+    
+    # Segment extraction shells out to ffmpeg
+    if not shutil.which("ffmpeg"):
+        logger.error("❌ ffmpeg not found")
+        logger.error("💡 Install ffmpeg and make sure it is on your PATH")
+        return
+    
+    # Check if ACRCloud credentials are available
+    acrcloud_key = os.getenv('ACRCLOUD_ACCESS_KEY')
+    acrcloud_secret = os.getenv('ACRCLOUD_ACCESS_SECRET')
+    acrcloud_host = os.getenv('ACRCLOUD_HOST')
+    
+    if acrcloud_key and acrcloud_secret and acrcloud_host:
+        logger.info("✅ ACRCloud credentials found in .env file")
+        logger.info("   Host: %s", acrcloud_host)
+    else:
+        logger.warning("⚠️  ACRCloud credentials not found in .env file")
+    
+    if serve:
+        serve_urls()
+        return
+    
+    downloads = {}
+    for i, url in enumerate(urls):
+        if len(urls) > 1:
+            logger.info("\n" + "#"*60)
+            logger.info("🎬 [%s/%s] %s", i+1, len(urls), url)
+            logger.info("#"*60)
+        
+        # Keep the next DOWNLOAD_AHEAD downloads running while this URL is identified
+        for j in range(i + 1, min(i + 1 + DOWNLOAD_AHEAD, len(urls))):
+            if j not in downloads and not cached_video_result(urls[j]):
+                downloads[j] = _run_in_background(download_with_yt_dlp, urls[j], f"audio_{j+1}.%(ext)s", True)
+        
+        identify_url(url, downloads.pop(i, None))
 
 if __name__ == "__main__":
+    logging.basicConfig(level=LOG_LEVEL, format="%(message)s", stream=sys.stdout)
     main() 
\ No newline at end of file
@@ -5,67 +5,80 @@ Tests multiple 20-second segments from separated no-vocals audio
 """
 
 import os
-import json
+import argparse
 import sys
-import base64
-import hashlib
-import hmac
-import time
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from requests_toolbelt.multipart.encoder import MultipartEncoder
 import random
 import subprocess
+import concurrent.futures
 from pathlib import Path
 from dotenv import load_dotenv
 
+# Duration probing, segment planning, request signing, connection warm-up,
+# response parsing, the confidence check, the Demucs model and the upload
+# sample rate are shared with the pipeline so both scripts behave the same
+from simple_pipeline import (DEMUCS_MODEL, UPLOAD_CODEC_ARGS, UPLOAD_SAMPLE_RATE, build_signature_context, confidence_score, get_audio_duration,
+                             is_confident, parse_acrcloud_response, plan_segment_start_times, warm_connection)
+
 # Load environment variables
 load_dotenv()
 
-def get_audio_duration(audio_path):
-    """Get audio duration using ffprobe"""
-    try:
-        cmd = [
-            "ffprobe", 
-            "-v", "quiet", 
-            "-show_entries", "format=duration", 
-            "-of", "csv=p=0", 
-            str(audio_path)
-        ]
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-        return float(result.stdout.strip())
-    except (subprocess.CalledProcessError, FileNotFoundError, ValueError):
-        print("⚠️  Could not determine audio duration, assuming 60 seconds")
-        return 60.0
+# Shared keep-alive session so the parallel segment uploads reuse TCP/TLS
+# connections; failed connection attempts are retried with a short backoff
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(pool_connections=2, pool_maxsize=5,
+                                      max_retries=Retry(total=2, backoff_factor=0.3)))
 
-def extract_audio_segment(input_path, output_path, start_time, duration=20):
-    """Extract a segment from audio file using ffmpeg"""
+def extract_audio_segment(input_path, start_time, duration=20):
+    """Extract a segment as MP3 bytes, piped from ffmpeg's stdout (None on failure)"""
+    # ACRCloud fingerprints at 8 kHz mono anyway, so upload small mono MP3s;
+    # with UPLOAD_SAMPLE_RATE=0, MP3 input is copied as-is and WAV is encoded
+    if UPLOAD_SAMPLE_RATE > 0:
+        codec_args = UPLOAD_CODEC_ARGS
+    elif Path(input_path).suffix == ".mp3":
+        codec_args = ["-c", "copy"]  # Copy without re-encoding for speed
+    else:
+        codec_args = ["-c:a", "libmp3lame", "-b:a", "128k"]
     try:
         cmd = [
             "ffmpeg",
+            "-ss", str(start_time),  # Input-side seek jumps straight to the start
             "-i", str(input_path),
-            "-ss", str(start_time),
             "-t", str(duration),
-            "-c", "copy",  # Copy without re-encoding for speed
-            "-y",  # Overwrite output file
-            str(output_path)
+            *codec_args,
+            "-avoid_negative_ts", "make_zero",
+            "-f", "mp3",
+            "-"  # No temp file: the segment only lives in the pipe
         ]
-        subprocess.run(cmd, check=True, capture_output=True)
-        return True
+        result = subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        return result.stdout
     except subprocess.CalledProcessError as e:
         print(f"❌ Failed to extract segment: {e}")
-        return False
+        return None
 
 def find_no_vocals_audio():
     """Find the separated no-vocals audio file"""
-    # Look for the no_vocals.mp3 file in the separated directory
-    no_vocals_path = Path("separated/htdemucs/audio/no_vocals.mp3")
-    
-    if no_vocals_path.exists():
+    # Demucs writes separated/<model>/<input>/no_vocals.<ext> and UVR writes
+    # separated/vr/<input>/<input>_(Instrumental)_<model>.<ext>, where the
+    # input is audio, audio_trimmed, audio_2, ... (WAV, or MP3 with UPLOAD_SAMPLE_RATE=0)
+    candidates = [
+        path for path in Path("separated").glob("*/audio*/*")
+        if path.suffix.lower() in (".wav", ".mp3")
+        and (path.stem == "no_vocals" or "instrumental" in path.name.lower())
+    ]
+    if candidates:
+        # Prefer DEMUCS_MODEL's and UVR's output, then the newest; detecting the
+        # device's default model would import torch just to rank the paths
+        no_vocals_path = max(candidates, key=lambda path: (path.parts[1] in (DEMUCS_MODEL, "vr"), path.stat().st_mtime))
         print(f"✅ Found no-vocals audio: {no_vocals_path}")
         return no_vocals_path
     
     # Fallback to original audio if no separated file exists
-    original_audio = Path("audio.mp3")
-    if original_audio.exists():
+    original_audio = next(Path(".").glob("audio.*"), None)
+    if original_audio:
         print(f"⚠️  No separated audio found, using original: {original_audio}")
         return original_audio
     
@@ -73,10 +86,8 @@ def find_no_vocals_audio():
     print("💡 Run the pipeline first to download and separate audio")
     return None
 
-def test_acrcloud_rest_api():
-    """Test ACRCloud REST API with separated no-vocals audio segments"""
-    
-    # Check credentials
+def load_credentials():
+    """Read and report the ACRCloud credentials from the environment, or None if incomplete"""
     access_key = os.getenv('ACRCLOUD_ACCESS_KEY')
     access_secret = os.getenv('ACRCLOUD_ACCESS_SECRET')
     host = os.getenv('ACRCLOUD_HOST')
@@ -87,15 +98,57 @@ def test_acrcloud_rest_api():
         print("   ACRCLOUD_ACCESS_KEY=your_access_key")
         print("   ACRCLOUD_ACCESS_SECRET=your_access_secret")
         print("   ACRCLOUD_HOST=your_host")
-        return False
+        return None
     
     print("✅ ACRCloud credentials found")
     print(f"   Host: {host}")
     print(f"   Access Key: {access_key[:8]}...")
     print(f"   Access Secret: {access_secret[:8]}...")
+    return {'access_key': access_key, 'access_secret': access_secret, 'host': host}
+
+def test_segments(audio_file, numbered_start_times, sig_ctx, max_segments):
+    """Extract and test (segment_num, start_time) pairs in parallel
+    
+    Prints each segment's log in segment order and returns the matches,
+    also in segment order.
+    """
+    # Each worker cuts its own segment and uploads it, so the ffmpeg
+    # processes run side by side and the network waits overlap
+    print(f"✂️  Extracting and testing {len(numbered_start_times)} segment(s) in parallel...")
+    results = []
+    logs = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(numbered_start_times)) as ex:
+        futures = {
+            ex.submit(test_segment_at, audio_file, start_time, sig_ctx, segment_num): segment_num
+            for segment_num, start_time in numbered_start_times
+        }
+        for future in concurrent.futures.as_completed(futures):
+            result, logs[futures[future]] = future.result()
+            if result:
+                results.append(result)
+    
+    # Print each segment's log as one block, in segment order
+    for segment_num in sorted(logs):
+        print(f"\n🎵 Segment {segment_num}/{max_segments}:\n" + "\n".join(f"   {line}" for line in logs[segment_num]))
+    
+    # Keep the summary in segment order regardless of completion order
+    return sorted(results, key=lambda r: r['segment'])
+
+def test_acrcloud_rest_api(creds=None, audio_file=None, early_exit=True, min_confidence=80):
+    """Test ACRCloud REST API with separated no-vocals audio segments
+    
+    creds (from load_credentials) and audio_file default to the environment
+    and to the separated audio, so callers can benchmark with their own.
+    With early_exit, the remaining segments are skipped when the first one
+    matches with at least min_confidence.
+    """
+    creds = creds or load_credentials()
+    if not creds:
+        return False
+    access_key, access_secret, host = creds['access_key'], creds['access_secret'], creds['host']
     
     # Find the audio file to test with
-    audio_file = find_no_vocals_audio()
+    audio_file = audio_file or find_no_vocals_audio()
     if not audio_file:
         return False
     
@@ -109,54 +162,32 @@ def test_acrcloud_rest_api():
     # Always extract multiple segments for better testing
     print("📦 Extracting multiple 20-second segments for testing...")
     
-    # Calculate how many segments we can extract
-    max_segments = min(5, int(duration // 20))  # Test up to 5 segments
-    if max_segments < 1:
+    # Up to 5 start times spread evenly across the audio
+    start_times = plan_segment_start_times(duration)
+    if not start_times:
         print("❌ Audio file too short to extract segments")
         return False
-        
-    print(f"🎯 Will test {max_segments} 20-second segments")
-    
-    # Generate start times (spread evenly across the audio)
-    start_times = []
-    available_duration = duration - 20  # Leave room for 20-second segment
-    
-    if available_duration <= 0:
-        print("❌ Audio file too short")
-        return False
     
-    # Generate evenly spaced start times
-    for i in range(max_segments):
-        # Spread segments across the audio, avoiding the very beginning and end
-        start_time = 5 + (i * (available_duration - 10) / max_segments)
-        start_times.append(start_time)
+    max_segments = len(start_times)
+    print(f"🎯 Will test {max_segments} 20-second segments")
     
     print(f"🎵 Segment start times: {[f'{t:.1f}s' for t in start_times]}")
     
-    # Test each segment
-    results = []
-    for i, start_time in enumerate(start_times):
-        print(f"\n🎵 Testing segment {i+1}/{max_segments} (starting at {start_time:.1f}s)...")
-        
-        # Create temporary segment file
-        segment_path = Path(f"test_segment_{i+1}.mp3")
-        
-        # Extract segment
-        if not extract_audio_segment(audio_file, segment_path, start_time, 20):
-            print(f"❌ Failed to extract segment {i+1}")
-            continue
-        
-        # Test this segment
-        result = test_single_segment(segment_path, access_key, access_secret, host, i+1)
-        
-        # Clean up segment file
-        try:
-            segment_path.unlink()
-        except:
-            pass
-        
-        if result:
-            results.append(result)
+    # One signature covers every segment of the run
+    sig_ctx = build_signature_context(access_key, access_secret, host)
+    warm_connection(host, SESSION)
+    numbered_start_times = list(enumerate(start_times, 1))
+    
+    # With early exit, try the first segment alone: when one song covers the
+    # whole Short, a confident match there makes the other uploads redundant
+    if early_exit and len(numbered_start_times) > 1:
+        results = test_segments(audio_file, numbered_start_times[:1], sig_ctx, max_segments)
+        if any(is_confident(result, min_confidence) for result in results):
+            print(f"\n⏩ Confident match in segment 1, skipping the other {max_segments - 1} segments")
+        else:
+            results += test_segments(audio_file, numbered_start_times[1:], sig_ctx, max_segments)
+    else:
+        results = test_segments(audio_file, numbered_start_times, sig_ctx, max_segments)
     
     # Display summary of results
     print("\n" + "="*60)
@@ -170,13 +201,11 @@ def test_acrcloud_rest_api():
         # Group by song (in case multiple segments match the same song)
         unique_songs = {}
         for result in results:
-            song_key = f"{result['title']}_{result['artist']}"
-            if song_key not in unique_songs:
+            song_key = (result['title'], result['artist'])
+            # Keep the one with higher confidence
+            best = unique_songs.get(song_key)
+            if best is None or confidence_score(result) > confidence_score(best):
                 unique_songs[song_key] = result
-            else:
-                # Keep the one with higher confidence
-                if result['confidence'] > unique_songs[song_key]['confidence']:
-                    unique_songs[song_key] = result
         
         print(f"🎵 Unique songs found: {len(unique_songs)}")
         print()
@@ -202,103 +231,57 @@ def test_acrcloud_rest_api():
         print("   • The vocal removal didn't work well")
         return False
 
-def test_single_segment(audio_path, access_key, access_secret, host, segment_num):
-    """Test a single audio segment with ACRCloud"""
+def test_segment_at(audio_file, start_time, sig_ctx, segment_num):
+    """Extract the segment starting at start_time and test it; returns (result, log)"""
+    sample = extract_audio_segment(audio_file, start_time, 20)
+    if not sample:
+        return None, [f"❌ Failed to extract segment starting at {start_time:.1f}s"]
+    return test_single_segment(sample, f"test_segment_{segment_num}.mp3", sig_ctx, segment_num)
+
+def test_single_segment(sample, sample_name, sig_ctx, segment_num):
+    """Test a single in-memory MP3 segment with ACRCloud
+    
+    Returns (result, log): output lines are collected instead of printed so
+    parallel uploads do not interleave on stdout.
+    """
+    log = []
     try:
-        # Build the request URL
-        requrl = f"https://{host}/v1/identify"
-        
-        # HTTP method and URI
-        http_method = "POST"
-        http_uri = "/v1/identify"
-        data_type = "audio"
-        signature_version = "1"
-        timestamp = time.time()
-        
-        # Create signature string
-        string_to_sign = (http_method + "\n" + http_uri + "\n" + access_key + "\n" + 
-                         data_type + "\n" + signature_version + "\n" + str(timestamp))
-        
-        # Generate signature
-        sign = base64.b64encode(
-            hmac.new(access_secret.encode('ascii'), 
-                    string_to_sign.encode('ascii'),
-                    digestmod=hashlib.sha1).digest()
-        ).decode('ascii')
-        
-        # Get file size
-        sample_bytes = os.path.getsize(str(audio_path))
-        
-        # Prepare files and data for upload
-        files = [
-            ('sample', (audio_path.name, open(str(audio_path), 'rb'), 'audio/mpeg'))
-        ]
-        
-        data = {
-            'access_key': access_key,
-            'sample_bytes': sample_bytes,
-            'timestamp': str(timestamp),
-            'signature': sign,
-            'data_type': data_type,
-            'signature_version': signature_version
-        }
+        sample_bytes = len(sample)
         
-        print(f"📤 Uploading {sample_bytes} bytes to ACRCloud...")
+        log.append(f"📤 Uploading {sample_bytes} bytes to ACRCloud...")
         
-        # Make the request
-        r = requests.post(requrl, files=files, data=data, timeout=30)
-        r.encoding = "utf-8"
+        # The encoder streams the fields and the sample bytes without
+        # building a second copy of the multipart body
+        encoder = MultipartEncoder(fields={
+            'access_key': sig_ctx['access_key'],
+            'sample_bytes': str(sample_bytes),
+            'timestamp': sig_ctx['timestamp'],
+            'signature': sig_ctx['signature'],
+            'data_type': sig_ctx['data_type'],
+            'signature_version': sig_ctx['signature_version'],
+            'sample': (sample_name, sample, 'audio/mpeg')
+        })
+        r = SESSION.post(sig_ctx['requrl'], data=encoder, headers={'Content-Type': encoder.content_type}, timeout=30)
         
-        # Parse JSON response
-        try:
-            result = json.loads(r.text)
-            
-            # Check status
-            status = result.get('status', {})
-            if status.get('code') == 0:
-                if result.get('metadata', {}).get('music'):
-                    print("✅ SUCCESS: Song identified!")
-                    music = result['metadata']['music'][0]
-                    
-                    # Extract song information
-                    song_info = {
-                        'title': music.get('title', 'Unknown'),
-                        'artist': music.get('artists', [{}])[0].get('name', 'Unknown'),
-                        'album': music.get('album', {}).get('name', 'Unknown'),
-                        'genre': music.get('genres', [{}])[0].get('name', 'Unknown'),
-                        'confidence': music.get('score', 'Unknown'),
-                        'segment': segment_num
-                    }
-                    
-                    print(f"   🎵 Title: {song_info['title']}")
-                    print(f"   👤 Artist: {song_info['artist']}")
-                    print(f"   📀 Album: {song_info['album']}")
-                    print(f"   🎼 Genre: {song_info['genre']}")
-                    print(f"   🎯 Confidence: {song_info['confidence']}")
-                    
-                    return song_info
-                else:
-                    print("⚠️  No music found in this segment")
-                    return None
-            else:
-                print(f"❌ API Error: {status.get('msg', 'Unknown error')}")
-                if status.get('code') == 3014:  # Invalid signature
-                    print("💡 This might be a credential issue - check your .env file")
-                return None
-                
-        except json.JSONDecodeError as e:
-            print(f"❌ Invalid JSON response: {e}")
-            return None
-            
+        result, response_log = parse_acrcloud_response(r.content, segment_num)
+        return result, log + response_log
+    
     except Exception as e:
-        print(f"❌ Error: {e}")
-        return None
+        log.append(f"❌ Error: {e}")
+        return None, log
 
 def main():
+    parser = argparse.ArgumentParser(description="Test ACRCloud with segments of the separated no-vocals audio")
+    parser.add_argument("--all-segments", action="store_true",
+                        help="always test every segment, even after a confident match")
+    parser.add_argument("--min-confidence", type=float, default=80,
+                        help="ACRCloud score that ends the test early (default: 80)")
+    args = parser.parse_args()
+    
     print("🧪 Enhanced ACRCloud Test with No-Vocals Audio")
     print("=" * 60)
     
-    success = test_acrcloud_rest_api()
+    success = test_acrcloud_rest_api(early_exit=not args.all_segments, min_confidence=args.min_confidence)
     
     if success:
         print("\n🎉 Test completed successfully!")